@@ -1,8 +1,13 @@
 import re
+import threading
+import time
 from datetime import datetime, timedelta
 from dateutil.parser import parse
+import jieba
 import jieba.posseg as psg
 
+from decode_budget import LEVEL_DICT, LEVEL_SEGMENT, LEVEL_VITERBI, Budget, BudgetResult, level_stats, replay
+
 # 优化点:
 #   1. check_time_valid(word)中的第一个if语句感觉可以优化的更简单明了一些
 #   2. 核心正则表达式感觉还有些问题，普适性不强
@@ -18,6 +23,18 @@ UTIL_CN_NUM = {
 }
 UTIL_CN_UTIL = {'十': 10, '百': 100, '千': 1000, '万': 10000}
 
+# 只分词时，根据字符规则判断数字与时间词
+RULE_NUM = re.compile('[0-9０-９零一二两三四五六七八九十百千万]+$')
+RULE_TIME = re.compile('([0-9０-９零一二两三四五六七八九十百千万]+)?[年月日号点时分秒]$|凌晨|早上|上午|中午|下午|晚上')
+
+# time_extract()使用的级别，与cut()不同，第二级是只按词典切分，而不是beam剪枝
+TIME_EXTRACT_LEVELS = (LEVEL_VITERBI, LEVEL_DICT, LEVEL_SEGMENT)
+level_stats.register('time_extract', TIME_EXTRACT_LEVELS)
+
+# time_extract()各级别每个字的相对计算量，由warm_up()测量，测量之前每个级别都按每个字1计算
+time_extract_work = {}
+_work_lock = threading.Lock()
+
 
 def check_time_valid(word):
     """
@@ -176,7 +193,86 @@ def parse_datetime(msg):
             return None
 
 
-def time_extract(text):
+def rule_cut(text):
+    """
+    只分词，不使用词性标注，按字符规则给数字与时间词标注"m"和"t"，其余的词标注为"x"
+    :param text: 每一个请求文本
+    :return: 生成器，每次产生(词语, 词性)
+    """
+    for k in jieba.cut(text, HMM=False):
+        if RULE_NUM.match(k):
+            yield k, 'm'
+        elif RULE_TIME.match(k):
+            yield k, 't'
+        else:
+            yield k, 'x'
+
+
+# time_extract()各级别的分词方式，见budget_cut()
+TIME_EXTRACT_CUTS = ((LEVEL_VITERBI, lambda text: psg.cut(text)),
+                     (LEVEL_DICT, lambda text: psg.cut(text, HMM=False)),
+                     (LEVEL_SEGMENT, rule_cut))
+
+
+def measure_work(texts=('我要住到明天下午三点', '我要从26号下午4点住到8月2号', '我要预定今天到30号的房间'),
+                 repeat=20):
+    """
+    测量各级别处理一个字的耗时，以segment级别为1，得到各级别每个字的相对计算量
+    :param texts: 用于测量的句子
+    :param repeat: 重复次数
+    :return: 级别 -> 每个字的计算量
+    """
+    chars = repeat * sum(len(text) for text in texts)
+    rates = {}
+    for level, cut in TIME_EXTRACT_CUTS:
+        list(cut(texts[0]))  # 预热，jieba第一次调用时加载词典
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                list(cut(text))
+        rates[level] = (time.perf_counter() - start) / chars
+
+    return {level: rate / rates[LEVEL_SEGMENT] for level, rate in rates.items()}
+
+
+def warm_up():
+    """
+    加载jieba词典，并测量time_extract()各级别每个字的相对计算量
+    带max_work调用time_extract()之前需要先调用一次，测量的耗时不会计入某个请求的预算；
+    多个线程同时调用时只测量一次
+    :return: time_extract_work
+    """
+    with _work_lock:
+        if not time_extract_work:
+            jieba.initialize()
+            time_extract_work.update(measure_work())
+    return time_extract_work
+
+
+def budget_cut(text, budget):
+    """
+    在预算内选择分词与词性标注的方式，预算不够时依次降级，级别见TIME_EXTRACT_LEVELS:
+        viterbi: jieba词性标注，未登录词使用HMM(Viterbi)识别
+        dict: jieba词性标注，不使用HMM，只按词典中的最大概率路径切分
+        segment: 只分词，按字符规则判断数字与时间词
+    :param text: 每一个请求文本
+    :param budget: Budget
+    :return: (词语, 词性)列表，使用的级别
+    """
+    if budget.max_work is not None and not time_extract_work:
+        raise RuntimeError('call warm_up() before time_extract() with max_work')
+
+    start = time.perf_counter()
+    for level, cut in TIME_EXTRACT_CUTS:
+        work = len(text) * time_extract_work.get(level, 1)
+        if level == LEVEL_SEGMENT or budget.allows('time_extract', level, work):
+            words = [(k, v) for k, v in cut(text)]
+            if budget.limited:
+                level_stats.record('time_extract', level, work, time.perf_counter() - start)
+            return words, level
+
+
+def time_extract(text, max_work=None, max_seconds=None):
     """
     思路:
         通过jieba分词将带有时间信息的词进行切分，记录连续时间信息的词。
@@ -186,13 +282,17 @@ def time_extract(text):
         对句子进行解析，提取其中所有能表示日期时间的词，并进行上下文拼接
 
     :param text: 每一个请求文本
-    :return: 解析出来后最终的句子
+    :param max_work: 最大计算量，以segment级别处理一个字为1，其他级别每个字的计算量由warm_up()测量，
+                     需要先调用warm_up()，None表示不限制
+    :param max_seconds: 最长耗时(秒)，None表示不限制
+    :return: 解析出来后最终的句子，level属性为实际使用的级别，见budget_cut()
     """
 
     time_res = []
     word = ''
     key_date = {'今天': 0, '明天': 1, '后天': 2}
-    for k, v in psg.cut(text):
+    words, level = budget_cut(text, Budget(max_work, max_seconds))
+    for k, v in words:
         # k: 词语, v: 词性
         if k in key_date:
             # 当k存在于key_date中时
@@ -225,7 +325,20 @@ def time_extract(text):
     result = list(filter(lambda x: x is not None, [check_time_valid(w) for w in time_res]))
     final_res = [parse_datetime(w) for w in result]
 
-    return [x for x in final_res if x is not None]
+    return BudgetResult([x for x in final_res if x is not None], level)
+
+
+def time_extract_columnar(texts, tagging, workers=None, **budget):
+    """
+    批量抽取时间，与分词词性标注结果一起输出为列式结果
+
+    :param texts: 请求文本列表
+    :param tagging: PartOfSpeechTagging，用于分词与词性标注
+    :param workers: 线程数
+    :param budget: 传给time_extract()的预算参数，如max_seconds=0.01
+    :return: ColumnarBatch，每个句子的time_extract()结果可以用extracted(i)读取
+    """
+    return tagging.cut_columnar(texts, workers, extract=lambda text: time_extract(text, **budget))
 
 
 if __name__ == '__main__':
@@ -244,5 +357,7 @@ if __name__ == '__main__':
     text5 = '今天30号呵呵'
     print(text5, time_extract(text5), sep=':')
 
-
-
+    # 回放请求，统计在预算下各级别被使用的次数
+    print(warm_up())
+    print(replay('time_extract', time_extract, [text1, text2, text3, text4, text5] * 20,
+                 max_work=30 * time_extract_work[LEVEL_DICT]))
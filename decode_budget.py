@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import Counter
+
+# 解码级别，按精度从高到低排列，预算不够时依次降级
+LEVEL_VITERBI = 'viterbi'  # 完整的联合Viterbi解码
+LEVEL_BEAM = 'beam'  # 每一步只保留得分最高的若干个状态
+LEVEL_SEGMENT = 'segment'  # 只分词，不标注词性
+LEVELS = (LEVEL_VITERBI, LEVEL_BEAM, LEVEL_SEGMENT)  # cut()使用的级别
+
+# 其他调用方可以使用自己的级别，用LevelStats.register()登记，如time_extract()没有beam，而是:
+LEVEL_DICT = 'dict'  # 只按词典中的最大概率路径切分，不用HMM识别未登录词
+
+
+class DeadlineExceeded(Exception):
+    """
+    按已用时间估计会超过截止时间，解码提前放弃
+
+    Attribute:
+        done: 放弃前已经完成的比例，0到1之间
+    """
+
+    def __init__(self, done):
+        super().__init__('deadline exceeded after %.0f%% of the work' % (done * 100))
+        self.done = done
+
+
+class Budget:
+    """
+    单次调用的预算，max_work与max_seconds可以只给一个，都不给时不限制
+
+    Attribute:
+        max_work: 最大计算量，单位由调用方定义，cut()与time_extract()中都以segment级别处理一个字的耗时为1
+        deadline: 截止时间(time.perf_counter())
+    """
+
+    def __init__(self, max_work=None, max_seconds=None):
+        self.max_work = max_work
+        self.deadline = time.perf_counter() + max_seconds if max_seconds is not None else None
+
+    @property
+    def limited(self):
+        """
+        :return: 是否给定了预算，没有预算时调用方不需要记录统计，避免多线程调用时争用level_stats的锁
+        """
+        return self.max_work is not None or self.deadline is not None
+
+    def remaining(self):
+        """
+        :return: 剩余的秒数，没有时间限制时返回None
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.perf_counter()
+
+    def allows(self, name, level, work):
+        """
+        判断某个级别的解码是否能在预算内完成
+        时间根据该级别以往每单位计算量的耗时估计，还没有记录时认为可以完成
+
+        :param name: 调用方名称，如'cut'
+        :param level: 解码级别
+        :param work: 该级别需要的计算量
+        :return:
+        """
+        if self.max_work is not None and work > self.max_work:
+            return False
+
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = level_stats.estimate(name, level, work)
+            return seconds is None or seconds <= remaining
+
+        return True
+
+
+class LevelStats:
+    """
+    记录每个调用方使用各级别解码的次数，以及每单位计算量的平均耗时，多个线程可以同时记录
+
+    Attribute:
+        counts: (调用方名称, 级别) -> 次数
+        rates: (调用方名称, 级别) -> 每单位计算量的耗时(秒)，指数滑动平均
+        levels: 调用方名称 -> 该调用方使用的级别，没有登记时为LEVELS
+    """
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.counts = Counter()
+        self.rates = {}
+        self.levels = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, levels):
+        """
+        登记调用方使用的级别，snapshot()与replay()按这些级别输出次数
+
+        :param name: 调用方名称
+        :param levels: 按精度从高到低排列的级别
+        :return:
+        """
+        self.levels[name] = tuple(levels)
+
+    def record(self, name, level, work, seconds):
+        """
+        :param name: 调用方名称
+        :param level: 实际使用的级别
+        :param work: 计算量
+        :param seconds: 耗时
+        :return:
+        """
+        with self._lock:
+            self.counts[name, level] += 1
+            self.update_rate(name, level, work, seconds)
+
+    def observe(self, name, level, work, seconds):
+        """
+        只更新耗时估计，不计入次数，用于超过截止时间而放弃的尝试，
+        否则没有成功过的级别永远没有耗时估计，之后的调用会一直尝试再放弃
+
+        :param name: 调用方名称
+        :param level: 放弃的级别
+        :param work: 放弃前已经完成的计算量
+        :param seconds: 耗时
+        :return:
+        """
+        with self._lock:
+            self.update_rate(name, level, work, seconds)
+
+    def update_rate(self, name, level, work, seconds):
+        """
+        更新每单位计算量耗时的指数滑动平均，调用方需要持有锁
+
+        :return:
+        """
+        if work > 0:
+            rate = seconds / work
+            last = self.rates.get((name, level))
+            self.rates[name, level] = rate if last is None else last + self.smoothing * (rate - last)
+
+    def estimate(self, name, level, work):
+        """
+        :return: 估计的耗时(秒)，还没有记录时返回None
+        """
+        rate = self.rates.get((name, level))
+        return None if rate is None else rate * work
+
+    def snapshot(self):
+        """
+        :return: 调用方名称 -> {级别: 次数}
+        """
+        with self._lock:
+            result = {}
+            for (name, level), count in self.counts.items():
+                result.setdefault(name, {k: 0 for k in self.levels.get(name, LEVELS)})[level] = count
+            return result
+
+    def reset(self, name=None):
+        """
+        清空次数，耗时估计保留，继续用于判断预算
+
+        :param name: 只清空该调用方的次数，None时清空所有调用方
+        :return:
+        """
+        with self._lock:
+            if name is None:
+                self.counts.clear()
+            else:
+                for key in [key for key in self.counts if key[0] == name]:
+                    del self.counts[key]
+
+
+level_stats = LevelStats()
+
+
+class BudgetResult(list):
+    """
+    带预算调用的结果，与原来的返回值一样是列表，另外记录实际使用的解码级别
+
+    Attribute:
+        level: 实际使用的解码级别
+    """
+
+    def __init__(self, items, level):
+        super().__init__(items)
+        self.level = level
+
+
+def replay(name, func, texts, **budget):
+    """
+    回放一批请求，统计各级别解码被使用的次数，只清空name的次数，不影响其他调用方
+    只有给定预算时才会记录次数，因此budget不能为空
+
+    :param name: 调用方名称，与func内部记录时使用的名称一致，如'cut'
+    :param func: 被回放的函数，如PartOfSpeechTagging().cut
+    :param texts: 请求文本
+    :param budget: 传给func的预算参数，如max_work=100000
+    :return: {级别: 次数}
+    """
+    level_stats.reset(name)
+    for text in texts:
+        func(text, **budget)
+    return level_stats.snapshot().get(name, {k: 0 for k in level_stats.levels.get(name, LEVELS)})
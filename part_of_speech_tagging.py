@@ -1,5 +1,546 @@
-import os
+import heapq
+import itertools
+import math
 import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+
+import numpy as np
+
+from decode_budget import (LEVEL_BEAM, LEVEL_SEGMENT, LEVEL_VITERBI, Budget, BudgetResult, DeadlineExceeded,
+                           level_stats, replay)
+from tagging_columnar import ColumnarBuilder
+
+NEG_INF = float('-inf')
+# 训练中没有见过的初始概率与发射概率使用的下限，与jieba相同，使路径得分始终是有限值
+MIN_FLOAT = -3.14e100
+# 默认的剪枝宽度，加载模型时按这个宽度测量beam级别的计算量
+BEAM = 8
+
+
+def log_prob(p, floor=NEG_INF):
+    """
+    概率取对数，避免长句子连乘造成下溢
+
+    :param p: 概率
+    :param floor: 概率为0时返回的值
+    :return: 对数概率
+    """
+    return math.log(p) if p > 0 else floor
+
+
+def make_word_list(line):
+    """
+    针对每个句子，按顺序拆分出来词语与词性，[]中的词语合并为一个长词，词性为]后面的词性
+    每行开头的文档编号(如19980131-03-017-001/m)不是正文，跳过
+
+    :param line: 输入的每个句子
+    :return: 由(词语, 词性)组成的列表
+    """
+    word_list = []
+    inner_word = None  # []内的词语，None表示当前不在[]中
+    for item in line.split(' ')[1:]:
+        if item == '':
+            # 切割后有空字符串，需要跳过
+            continue
+
+        if item.startswith('['):
+            inner_word = []
+            item = item[1:]
+
+        if inner_word is not None and ']' in item:
+            # 出现]才证明两个匹配了，将所有[]内的汉字拼接在一起成为长词
+            word, _, tagging = item.rpartition(']')
+            inner_word.append(word.rpartition('/')[0])
+            word_list.append((''.join(inner_word), tagging))
+            inner_word = None
+            continue
+
+        word, _, tagging = item.rpartition('/')
+        if inner_word is not None:
+            inner_word.append(word)
+        else:
+            word_list.append((word, tagging))
+
+    return word_list
+
+
+def position_constraints(states):
+    """
+    B/M/E/S标注的转移约束: B、M之后只能是同一词性的M或E，E、S之后只能是B或S
+    不合法的转移会还原出与某个合法序列相同的结果(如B_n B_n与S_n B_n)，解码时直接排除
+    句首与句尾不做约束，截断的句子可能从词语中间开始或结束，强制约束会使整条路径只能使用MIN_FLOAT
+
+    :param states: 状态标签，如'B_ns'，只分词的模型为'B'
+    :return: 表示由状态i转移到状态j是否合法的布尔数组，状态不是B/M/E/S标注时返回None
+    """
+    if any(s[: 1] not in ('B', 'M', 'E', 'S') or s[1: 2] not in ('', '_') for s in states):
+        return None
+
+    positions = np.array([s[0] for s in states], dtype=object)
+    tags = np.array([s[2:] for s in states], dtype=object)
+    opened = np.isin(positions, ('B', 'M'))  # 词语还没有结束
+    closing = np.isin(positions, ('M', 'E'))  # 只能接在词语中间
+
+    return np.where(opened[:, None], closing[None, :] & (tags[:, None] == tags[None, :]), ~closing[None, :])
+
+
+def make_words(text, pos_list):
+    """
+    根据每个字的复合标签，将句子还原为词语与词性
+
+    :param text: 输入的句子
+    :param pos_list: 每个字的标签，如'B_ns'
+    :return: 由(词语, 词性)组成的列表
+    """
+    words = []
+    begin = 0
+    for i, pos in enumerate(pos_list):
+        position = pos[0]
+        if position in 'BS' and begin < i:
+            # 上一个词没有以E结尾，遇到新词开头时先把它切出来
+            words.append((text[begin: i], pos_list[begin][2:]))
+            begin = i
+        if position in 'ES':
+            # 词性以词语第一个字的标签为准
+            words.append((text[begin: i + 1], pos_list[begin][2:]))
+            begin = i + 1
+
+    if begin < len(text):
+        words.append((text[begin:], pos_list[begin][2:]))
+
+    return words
+
+
+class HMMModel:
+    """
+    只读的HMM模型，加载一次之后不可再修改，多个线程可以共享同一个实例进行解码
+    概率全部以对数保存为只读的numpy数组，每个字的一步解码都是对 状态数 * 状态数 矩阵的整体运算，
+    numpy在这些运算中会释放GIL，多个线程可以真正同时解码
+    某个状态没有发射过的字，发射概率为MIN_FLOAT而不是负无穷，任何句子都至少有一条得分有限的路径
+    不合法的B/M/E/S转移概率为0，见position_constraints()
+
+    Attribute:
+        states: 状态标签元组
+        start_p: 初始概率，形状为(状态数,)
+        trans_p: 转移概率，trans_p[i, j]表示由状态i转移到状态j
+        emit_index: 字 -> emit_matrix中的行号
+        emit_matrix: 发射概率，每一行是一个字在各状态下的发射概率，
+            最后一行是训练中没有出现过的字，所有状态相同，交由转移概率决定
+        segment_model: 只分词的B/M/E/S四状态模型，由联合模型中同一位置的所有词性取最大值得到，
+            预算不够时使用；本身就是只分词的模型时为None
+    """
+
+    __slots__ = ('states', 'start_p', 'trans_p', 'emit_index', 'emit_matrix', 'segment_model')
+
+    def __init__(self, states, start_p, trans_p, emit_p):
+        """
+        :param states: 状态标签
+        :param start_p: 初始概率字典
+        :param trans_p: 转移概率字典
+        :param emit_p: 发射概率字典
+        """
+        states = tuple(states)
+        chars = set()
+        for s in states:
+            chars.update(emit_p.get(s, {}))
+        emit_index = {c: i for i, c in enumerate(sorted(chars))}
+
+        emit_matrix = np.full((len(chars) + 1, len(states)), MIN_FLOAT)
+        emit_matrix[-1] = 0.0
+        for y, s in enumerate(states):
+            for c, p in emit_p.get(s, {}).items():
+                emit_matrix[emit_index[c], y] = log_prob(p, MIN_FLOAT)
+
+        self.init_arrays(states,
+                         [log_prob(start_p.get(s, 0), MIN_FLOAT) for s in states],
+                         [[log_prob(trans_p.get(y0, {}).get(y, 0)) for y in states] for y0 in states],
+                         emit_index, emit_matrix)
+        super().__setattr__('segment_model', self.make_segment_model())
+
+    def init_arrays(self, states, start_p, trans_p, emit_index, emit_matrix):
+        """
+        设置对数概率，排除不合法的转移，所有数组设置为只读
+
+        :return:
+        """
+        set_attr = super().__setattr__
+        set_attr('states', tuple(states))
+        set_attr('emit_index', MappingProxyType(dict(emit_index)))
+
+        allowed = position_constraints(self.states)
+        if allowed is not None:
+            trans_p = np.where(allowed, trans_p, NEG_INF)
+
+        for name, value in (('start_p', start_p), ('trans_p', trans_p), ('emit_matrix', emit_matrix)):
+            value = np.array(value, dtype=np.float64)
+            value.setflags(write=False)
+            set_attr(name, value)
+
+    @classmethod
+    def from_log(cls, states, start_p, trans_p, emit_index, emit_matrix):
+        """
+        直接由对数概率数组构建模型
+
+        :param states: 状态标签
+        :param start_p: 初始概率
+        :param trans_p: 转移概率，trans_p[i, j]表示由状态i转移到状态j
+        :param emit_index: 字 -> emit_matrix中的行号
+        :param emit_matrix: 发射概率，最后一行为没有出现过的字
+        :return: HMMModel
+        """
+        model = cls.__new__(cls)
+        model.init_arrays(states, start_p, trans_p, emit_index, emit_matrix)
+        super(HMMModel, model).__setattr__('segment_model', None)
+        return model
+
+    def make_segment_model(self):
+        """
+        将联合状态按B/M/E/S合并，得到只分词的模型
+
+        :return: HMMModel，状态不是联合状态时返回None
+        """
+        positions = 'BMES'
+        if not self.states or any(s[: 2] not in ('B_', 'M_', 'E_', 'S_') for s in self.states):
+            return None
+
+        groups = [[i for i, s in enumerate(self.states) if s[0] == p] for p in positions]
+
+        def best(values, group):
+            return values[..., group].max(axis=-1) if group else np.full(values.shape[: -1], NEG_INF)
+
+        start_p = [best(self.start_p, g) for g in groups]
+        trans_p = [[best(self.trans_p[g0], g).max(initial=NEG_INF) for g in groups] for g0 in groups]
+        emit_matrix = np.stack([best(self.emit_matrix, g) for g in groups], axis=1)
+
+        return HMMModel.from_log(positions, start_p, trans_p, self.emit_index, emit_matrix)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('HMMModel is read-only')
+
+    def __delattr__(self, key):
+        raise AttributeError('HMMModel is read-only')
+
+    def emissions(self, text):
+        """
+        :param text: 输入的句子
+        :return: 每个字在各状态下的发射概率，形状为(字数, 状态数)
+        """
+        unknown = len(self.emit_matrix) - 1
+        return self.emit_matrix[[self.emit_index.get(c, unknown) for c in text]]
+
+    def forward(self, text, deadline=None, beam=None):
+        """
+        计算Viterbi表，只读取模型参数，中间结果都是局部变量，可以在多个线程中同时调用
+
+        :param text: 输入的句子，不能为空
+        :param deadline: 截止时间(time.perf_counter())，按已用时间估计整句会超过截止时间时
+                         提前放弃，抛出DeadlineExceeded，其中记录已经完成的比例
+        :param beam: 每一步只从得分最高的beam个状态转移，None表示完整计算
+        :return: V: 每个位置以各状态结尾的最优路径的对数概率(包含该位置的发射概率)，形状为(字数, 状态数)
+                 back: 回溯指针，back[t - 1, y]为位置t处于状态y时上一个字的状态
+        """
+        start = time.perf_counter()
+        emit = self.emissions(text)
+        V = np.empty(emit.shape)
+        back = np.empty((len(text) - 1, len(self.states)), dtype=np.intp)
+        V[0] = self.start_p + emit[0]
+        if beam is not None and beam >= len(self.states):
+            beam = None
+
+        for t in range(1, len(text)):
+            if deadline is not None:
+                now = time.perf_counter()
+                if now + (now - start) / t * (len(text) - t) > deadline:
+                    raise DeadlineExceeded(t / len(text))
+
+            candidates = None
+            if beam is not None:
+                candidates = np.argpartition(V[t - 1], -beam)[-beam:]
+            V[t], back[t - 1] = self.step(V[t - 1], emit[t], candidates)
+
+        return V, back
+
+    def step(self, last_V, emit, candidates=None):
+        """
+        Viterbi表向后扩展一列
+
+        :param last_V: 上一个字以各状态结尾的最优路径的对数概率
+        :param emit: 新的字在各状态下的发射概率，即emissions()中的一行
+        :param candidates: 只从这些状态转移，None表示从所有状态转移
+        :return: 新的一列，以及这一列的回溯指针
+        """
+        if candidates is None:
+            scores = last_V[:, None] + self.trans_p
+            new_back = scores.argmax(axis=0)
+        else:
+            scores = last_V[candidates, None] + self.trans_p[candidates]
+            best = scores.argmax(axis=0)
+            new_back = candidates[best]
+        return scores.max(axis=0) + emit, new_back
+
+    def viterbi(self, text):
+        """
+        :param text: 输入的句子
+        :return: 最优路径的对数概率，每个字的标签
+        """
+        prob, path = self.decode(text)
+        return prob, [self.states[i] for i in path]
+
+    def decode(self, text, deadline=None, beam=None):
+        """
+        与viterbi相同，但返回状态下标而不是标签字符串，批量输出时不需要为每个字生成字符串
+
+        :param text: 输入的句子
+        :param deadline: 截止时间，见forward()
+        :param beam: 剪枝宽度，见forward()
+        :return: 最优路径的对数概率，每个字的状态下标，超过截止时间时抛出DeadlineExceeded
+        """
+        if not text:
+            return NEG_INF, []
+
+        V, back = self.forward(text, deadline, beam)
+        state = int(V[-1].argmax())
+        prob = float(V[-1, state])
+        path = [state]
+        for col in back[:: -1].tolist():
+            state = col[state]
+            path.append(state)
+        path.reverse()
+
+        return prob, path
+
+    def measure_work(self, beam=BEAM, length=400, repeat=5):
+        """
+        测量各级别解码每个字的耗时，以segment级别为1，得到各级别每个字的相对计算量，用于预算判断
+        每一步都有固定的Python开销，状态数不多时与矩阵运算相当，beam剪枝并不能按 状态数 / beam 的比例
+        减少耗时，只能实际测量
+
+        :param beam: 剪枝宽度
+        :param length: 用于测量的句子长度，句子由训练中出现过的字循环组成
+        :param repeat: 每个级别重复的次数，取最快的一次
+        :return: 级别 -> 每个字的计算量
+        """
+        text = ''.join(itertools.islice(itertools.cycle(sorted(self.emit_index) or ['。']), length))
+        seconds = {}
+        for level, decode in ((LEVEL_VITERBI, lambda: self.decode(text)),
+                              (LEVEL_BEAM, lambda: self.decode(text, beam=beam)),
+                              (LEVEL_SEGMENT, lambda: self.segment_model.decode(text))):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                decode()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            seconds[level] = best
+
+        return {level: t / seconds[LEVEL_SEGMENT] for level, t in seconds.items()}
+
+    def nbest(self, text):
+        """
+        按概率从大到小惰性地枚举所有合法的标签序列
+        只计算一次Viterbi表，然后按Huang与Chiang的惰性k-best算法从句尾向句首展开:
+            每个(位置, 状态)按需保存以它结尾的前缀路径中概率最大的若干条，第一条就是Viterbi表中的最优路径；
+            它的前驱状态按(前驱的最优得分 + 转移概率)只排序一次，需要下一条前缀路径时，
+            只把上一次取出的候选的下一条前缀路径，以及排在该前驱状态后面的下一个前驱状态放入候选堆，
+            所以每多取一条路径只需要展开它与已有路径分叉之后的结点，不需要在每个位置遍历所有前驱状态
+
+        :param text: 输入的句子
+        :return: 生成器，每次产生(对数概率, 每个字的标签)
+        """
+        if not text:
+            return
+
+        V, back = self.forward(text)
+        V = V.tolist()
+        emit = self.emissions(text).tolist()
+        trans_in = self.trans_p.T  # trans_in[y]为转移到状态y的各个概率
+        n = len(text)
+        # (位置, 状态) -> [前缀路径, 候选堆, 排序后的前驱状态, 转移概率, 发射概率, 上一次取出且还没有展开的候选]
+        # 前缀路径为(对数概率, 前驱状态, 前驱的第几条前缀路径)，位置n是句尾之后的虚拟结点，状态为None
+        nodes = {}
+
+        def node(t, y):
+            item = nodes.get((t, y))
+            if item is None:
+                if t == 0:
+                    item = [[(V[0][y], None, None)], [], [], None, 0.0, None]
+                else:
+                    weights = np.zeros(len(self.states)) if y is None else trans_in[y]
+                    incoming = np.asarray(V[t - 1]) + weights
+                    order = [y0 for y0 in np.argsort(-incoming, kind='stable').tolist() if incoming[y0] > NEG_INF]
+                    extra = 0.0 if y is None else emit[t][y]
+                    item = [[(float(incoming[order[0]]) + extra, order[0], 0)] if order else [],
+                            [], order, weights.tolist(), extra, (0, 0) if order else None]
+                nodes[t, y] = item
+            return item
+
+        def kth(t, y, j):
+            """
+            :return: 以(t, y)结尾的第j条前缀路径，没有更多路径时返回None
+            """
+            stack = [(t, y, j)]
+            while stack:
+                t1, y1, j1 = stack[-1]
+                item = node(t1, y1)
+                paths, heap, order, weights, extra, pending = item
+                if len(paths) > j1 or (pending is None and not heap):
+                    stack.pop()
+                    continue
+
+                if pending is not None:
+                    # 展开上一次取出的候选: 同一前驱的下一条前缀路径，以及下一个前驱状态的最优路径
+                    r, k = pending
+                    y0 = order[r]
+                    pred = node(t1 - 1, y0)
+                    if len(pred[0]) <= k + 1 and (pred[5] is not None or pred[1]):
+                        stack.append((t1 - 1, y0, k + 1))
+                        continue
+                    if len(pred[0]) > k + 1:
+                        heapq.heappush(heap, (-(pred[0][k + 1][0] + weights[y0] + extra), r, k + 1))
+                    if k == 0 and r + 1 < len(order):
+                        y0 = order[r + 1]
+                        heapq.heappush(heap, (-(V[t1 - 1][y0] + weights[y0] + extra), r + 1, 0))
+                    item[5] = None
+                    continue
+
+                f, r, k = heapq.heappop(heap)
+                paths.append((-f, order[r], k))
+                item[5] = (r, k)
+
+            paths = node(t, y)[0]
+            return paths[j] if j < len(paths) else None
+
+        for j in itertools.count():
+            result = kth(n, None, j)
+            if result is None:
+                return
+
+            prob, y, k = result
+            path = []
+            for t in range(n - 1, -1, -1):
+                path.append(self.states[y])
+                _, y, k = node(t, y)[0][k]
+            path.reverse()
+            yield prob, path
+
+
+class ViterbiSession:
+    """
+    增量解码，每输入一个字只向Viterbi表添加一列，不需要对整个前缀重新解码
+    所有存活路径在某个位置汇合到同一个状态时，该位置及之前的标签就不会再改变，可以确定下来；
+    如果超过lag个字仍然没有汇合，则按当前最优路径强制确定最早的字，保证每个字的开销是常数
+
+    Attribute:
+        model: 只读的HMMModel，可以与其他会话共享
+        lag: 最多允许多少个字的标签未确定，None表示只在路径汇合时确定
+        chars: 已输入的字
+        tags: 已确定的标签
+    """
+
+    def __init__(self, model, lag=8):
+        self.model = model
+        self.lag = lag
+        self.chars = []
+        self.tags = []
+
+        self._V = None  # 最后一个字以各状态结尾的最优路径的对数概率
+        self._back = []  # 未确定部分的回溯指针，_back[i]对应第len(tags) + 1 + i个字
+
+    def feed(self, chars):
+        """
+        输入新的字
+
+        :param chars: 追加的字，可以是一个或多个
+        :return: 本次新确定的标签
+        """
+        committed = []
+        for char in chars:
+            emit = self.model.emissions(char)[0]
+            if self._V is None:
+                self._V = self.model.start_p + emit
+            else:
+                self._V, new_back = self.model.step(self._V, emit)
+                if len(self.chars) > len(self.tags):
+                    # 上一个字还没有确定时才需要保存回溯指针
+                    self._back.append(new_back.tolist())
+            self.chars.append(char)
+            committed.extend(self.commit())
+
+        return committed
+
+    def commit(self):
+        """
+        确定所有存活路径已经汇合的位置，或者超过lag的位置
+
+        :return: 新确定的标签
+        """
+        n, c = len(self.chars), len(self.tags)
+        if n == c:
+            return []
+
+        # 得分比最优路径低了一个MIN_FLOAT的状态之后不可能再成为最优路径，不算存活
+        threshold = self._V.max() + MIN_FLOAT / 2
+        survivors = set(np.flatnonzero(self._V > threshold).tolist())
+        t = n - 1
+        for col in reversed(self._back):
+            if len(survivors) <= 1:
+                break
+            survivors = {col[y] for y in survivors}
+            t -= 1
+
+        if len(survivors) == 1:
+            return self.commit_through(t, survivors.pop())
+
+        if self.lag is not None and n - c > self.lag:
+            # 超过lag仍未汇合，按当前最优路径强制确定
+            t = n - 1 - self.lag
+            y = int(self._V.argmax())
+            for col in reversed(self._back[t - c:]):
+                y = col[y]
+            return self.commit_through(t, y)
+
+        return []
+
+    def commit_through(self, t, y):
+        """
+        从第t个字的状态y回溯，确定第t个字及之前所有未确定的标签
+
+        :param t: 位置
+        :param y: 该位置的状态
+        :return: 新确定的标签
+        """
+        c = len(self.tags)
+        path = [y]
+        for col in reversed(self._back[: t - c]):
+            y = col[y]
+            path.append(y)
+        path.reverse()
+
+        # 第t + 1个字的回溯指针指向已经确定的位置，也不再需要
+        del self._back[: t - c + 1]
+        new_tags = [self.model.states[i] for i in path]
+        self.tags.extend(new_tags)
+
+        return new_tags
+
+    def finish(self):
+        """
+        输入结束，按最优路径确定剩余的所有标签
+
+        :return: 新确定的标签
+        """
+        if len(self.chars) == len(self.tags):
+            return []
+        return self.commit_through(len(self.chars) - 1, int(self._V.argmax()))
+
+    def words(self):
+        """
+        :return: 已确定部分的(词语, 词性)列表，最后一个词可能还没有结束
+        """
+        return make_words(''.join(self.chars[: len(self.tags)]), self.tags)
 
 
 class PartOfSpeechTagging:
@@ -14,8 +555,11 @@ class PartOfSpeechTagging:
             nr: 人名; ns: 地名; nt: 机构团体; nx: 字母专名; nz: 其他专名; o: 拟声词; p: 介词; q: 量词; r: 代词; s: 处所词;
             tg: 时语素; t: 时间词; u: 助词; vg: 动语素; v: 动词; vd: 副动词; vn: 名动词; w: 标点符号; x: 非语素字; y: 语气词;
             z: 状态词;
-        load_para: 参数加载，用于判断是否需要重新加载model_file
+        load_para: 参数加载，用于判断训练用的概率矩阵是否已经从model_file加载
         word_dic: 记录词语及其词性的字典
+        live_states: 训练语料中出现过的状态，与概率矩阵一起保存在model_file中，解码时只在这些状态上计算，
+            如make_label总是把数词标为S_m，B_m、M_m、E_m永远不会出现；语料中state_list没有的词性也会加入
+        model: 解码用的只读模型，第一次使用时从model_file加载，之后所有线程共享
     """
 
     def __init__(self):
@@ -41,6 +585,12 @@ class PartOfSpeechTagging:
 
         self.load_para = False
         self.word_dic = {}
+        self.live_states = []
+
+        self.level_work = {}  # 级别 -> 每个字的相对计算量，加载模型时由HMMModel.measure_work()测量
+
+        self._model = None
+        self._model_lock = threading.Lock()
 
     def try_load_model(self, trained):
         """
@@ -53,22 +603,66 @@ class PartOfSpeechTagging:
         :return:
         """
         if trained:
-            with open(self.model_file, 'rb') as f:
-                self.A_dic = pickle.load(f)
-                self.B_dic = pickle.load(f)
-                self.Pi_dic = pickle.load(f)
-                self.load_para = True
+            self.A_dic, self.B_dic, self.Pi_dic, self.live_states = self.read_model_file()
+            self.load_para = True
         else:
             self.A_dic = {}
             self.B_dic = {}
             self.Pi_dic = {}
+            self.live_states = []
             self.load_para = False
 
+    def read_model_file(self):
+        """
+        读取model_file
+
+        :return: 转移概率，发射概率，初始概率，出现过的状态
+        """
+        with open(self.model_file, 'rb') as f:
+            A_dic = pickle.load(f)
+            B_dic = pickle.load(f)
+            Pi_dic = pickle.load(f)
+            try:
+                live_states = pickle.load(f)
+            except EOFError:
+                # 之前的模型文件没有保存状态表，没有出现过的状态也就没有发射概率
+                live_states = [s for s in self.state_list if B_dic.get(s)]
+
+        return A_dic, B_dic, Pi_dic, live_states
+
+    def load_model(self):
+        """
+        从model_file读取概率矩阵并构建只读模型，不修改实例上的任何属性
+
+        :return: HMMModel
+        """
+        A_dic, B_dic, Pi_dic, live_states = self.read_model_file()
+        return HMMModel(live_states, Pi_dic, A_dic, B_dic)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                # 加锁后再判断一次，保证多个线程同时第一次调用时只加载一次
+                if self._model is None:
+                    self.set_model(self.load_model())
+        return self._model
+
+    def set_model(self, model):
+        """
+        测量各级别的计算量后再设置模型，其他线程看到模型时计算量已经可用，调用方需要持有_model_lock
+
+        :param model: HMMModel
+        :return:
+        """
+        self.level_work = model.measure_work()
+        self._model = model
+
     def train(self, path):
         """
         计算转移概率、发射概率以及初始概率
 
-        :param path:
+        :param path: 语料路径，或者由句子组成的可迭代对象
         :return:
         """
 
@@ -78,61 +672,18 @@ class PartOfSpeechTagging:
         # 统计状态出现次数, 求P(o)
         count_dic = {}
 
-        def init_parameters():
-            """
-            初始化参数
-
-            :return:
+        def init_parameters(state):
             """
-            for state in self.state_list:
-                self.A_dic[state] = {s: 0.0 for s in self.state_list}
-                self.B_dic[state] = {}
-                self.Pi_dic[state] = 0.0
-                count_dic[state] = 0
+            第一次遇到某个状态时初始化它的参数，计数表按语料中实际出现的状态建立，
+            state_list中没有的词性(如Rg、Yg)也可以训练
 
-        def make_word_list(line):
-            """
-            针对每个句子，拆分出来词语与词性，将词语与词性组成的字典返回
-            :param line: 输入的每个句子
+            :param state: 状态
             :return:
             """
-            if line.find('[') != -1:
-                # 如果这行文字中存在[]
-                first_index = 0
-                del_length = 0  # 中间删除的字符的长度
-                for i, w in enumerate(line):
-                    if w == '[':
-                        # 记录出现[的下标
-                        first_index = i - del_length
-                    if w == ']':
-                        # 记录出现]的下标，因为只有]出现了才证明两个匹配了，可以进行后面的内容
-                        second_index = i - del_length
-                        inner_line = line[first_index: second_index + 3]
-                        inner_word = inner_line.replace('[', '')  # 删除[
-                        inner_word = inner_word.replace(']', '/')  # 将]替换为/，方便后续切割
-                        inner_word = inner_word.split(' ')
-                        whole_word = ''
-                        for iw in inner_word:
-                            # 将所有[]内的汉字拼接在一起成为长词
-                            whole_word += iw.split('/')[0]
-
-                        self.word_dic[whole_word] = line[second_index + 1: second_index + 3]  # 词性也添加至字典
-
-                        line = line[: first_index] + line[second_index + 3:]
-
-                        # 因为line是变化的，枚举长度是不变的，就会造成每合并一次之后line的下标和i不匹配，
-                        # 所以需要把减少的这一部分给去除，因为i不变，而减少的长度是越来越长，所以需要累加
-                        # 每次减少的长度是两个括号+末尾词性的长度
-                        del_length += second_index + 3 - first_index
-
-            word_list = line.split(' ')
-            for word in word_list:
-                # 字典的键为词，值为词性
-                if word == '':
-                    # 切割后有空字符串，需要跳过
-                    continue
-
-                self.word_dic[word.split('/')[0]] = word.split('/')[1]
+            self.A_dic[state] = {}
+            self.B_dic[state] = {}
+            self.Pi_dic[state] = 0.0
+            count_dic[state] = 0
 
         def make_label(word, tagging):
             """
@@ -141,69 +692,243 @@ class PartOfSpeechTagging:
             :param tagging: 该词语的词性
             :return:
             """
-            out_text = []
+            out_tagging = []
             tagging = tagging.lower()
             if tagging == 'm':
                 # 如果这个词语是数字，那么单独成词
-                out_text.append('S_' + tagging)
+                out_tagging.append('S_' + tagging)
             elif len(word) == 1:
                 # 如果这个词语长度为1，且不为数字，那么单独成词
-                out_text.append('S_' + tagging)
+                out_tagging.append('S_' + tagging)
             else:
                 # 如果这个词语长度大于1，那么针对每个字设置相应的标签
-                out_text += ['B_' + tagging] + ['M_' + tagging] * (len(word) - 2) + ['E_' + tagging]
+                out_tagging += ['B_' + tagging] + ['M_' + tagging] * (len(word) - 2) + ['E_' + tagging]
 
-            for t in out_text:
-                if t not in self.state_list:
-                    print(word)
-                    print(t)
+            if len(out_tagging) != len(word):
+                # 数字整体标为S时，每个字都使用同一个标签
+                out_tagging = out_tagging * len(word)
 
-            return out_text
+            return out_tagging
 
-        init_parameters()
-        line_num = -1
+        def read_lines():
+            """
+            path为语料路径时逐行读取语料，否则认为path本身就是由句子组成的可迭代对象，
+            如CorpusIndex.iter_lines()读取出来的按日期切片或者划分好的子集
 
-        words = set()
-        with open(path, encoding='utf8') as f:
-            for line in f:
-                line_num += 1
-                line = line.strip()
+            :return:
+            """
+            if isinstance(path, str):
+                with open(path, encoding='utf8') as f:
+                    yield from f
+            else:
+                yield from path
+
+        line_num = 0
+
+        for line in read_lines():
+            line = line.strip()
+
+            if not line:
+                # 如果句子为空则跳过这轮循环
+                continue
+
+            word_list = make_word_list(line)
+            if not word_list:
+                continue
+            line_num += 1
+
+            line_state = []
+            line_text = ''
+
+            for w, t in word_list:
+                # w: 每个词语, t: 每个词语的词性
+                self.word_dic[w] = t
+                line_state.extend(make_label(w, t))
+                line_text += w
+
+            for k, v in enumerate(line_state):
+                if v not in count_dic:
+                    init_parameters(v)
+                count_dic[v] += 1
+                if k == 0:
+                    # 计算初始概率
+                    self.Pi_dic[v] += 1
+                else:
+                    # 计算转移概率
+                    self.A_dic[line_state[k - 1]][v] = self.A_dic[line_state[k - 1]].get(v, 0) + 1.0
+                # 计算发射概率
+                self.B_dic[v][line_text[k]] = self.B_dic[v].get(line_text[k], 0) + 1.0
+
+        # 训练语料中没有出现过的状态不可能出现在解码结果中，概率矩阵只保留出现过的状态，
+        # 按state_list中的顺序排列，state_list中没有的状态排在最后
+        self.live_states = [s for s in self.state_list if s in count_dic]
+        self.live_states += sorted(set(count_dic) - set(self.state_list))
+
+        self.Pi_dic = {k: (self.Pi_dic[k] + 1) / (line_num + 1) for k in self.live_states}
+        self.A_dic = {k: {k1: (self.A_dic[k].get(k1, 0) + 1) / (count_dic[k] + 1) for k1 in self.live_states}
+                      for k in self.live_states}
+        self.B_dic = {k: {k1: (v1 + 1) / (count_dic[k] + 1) for k1, v1 in self.B_dic[k].items()}
+                      for k in self.live_states}
+
+        with open(self.model_file, 'wb') as f:
+            pickle.dump(self.A_dic, f)
+            pickle.dump(self.B_dic, f)
+            pickle.dump(self.Pi_dic, f)
+            pickle.dump(self.live_states, f)
+
+        with self._model_lock:
+            self.set_model(HMMModel(self.live_states, self.Pi_dic, self.A_dic, self.B_dic))
+
+        return self
+
+    def beam_work(self, beam):
+        """
+        :param beam: 剪枝宽度
+        :return: 该宽度下每个字的计算量，在测量过的BEAM与完整解码(宽度为状态数)之间线性插值
+        """
+        n = len(self.model.states)
+        full, measured = self.level_work[LEVEL_VITERBI], self.level_work[LEVEL_BEAM]
+        if beam >= n:
+            return full
+        if n <= BEAM:
+            # 状态数不超过BEAM时测量的就是完整解码，无法插值
+            return measured
+        return max(measured + (full - measured) * (beam - BEAM) / (n - BEAM), 0.0)
+
+    def cut(self, text, max_work=None, max_seconds=None, beam=BEAM):
+        """
+        分词并标注词性，可以指定单次调用的预算，预算不够完整解码时依次降级:
+            viterbi: 完整的联合Viterbi解码
+            beam: 每一步只保留得分最高的beam个状态
+            segment: 只用B/M/E/S模型分词，词性为None，不再降级
+        各级别的计算量为 字数 * 每个字的计算量，每个字的计算量见level_work，以segment级别为1
+        按截止时间放弃的级别也会记录已完成部分的耗时，之后的调用根据耗时估计直接跳过该级别
+
+        :param text: 输入的句子
+        :param max_work: 最大计算量，None表示不限制
+        :param max_seconds: 最长耗时(秒)，None表示不限制
+        :param beam: 剪枝宽度
+        :return: 由(词语, 词性)组成的列表，level属性为实际使用的解码级别
+                 只有给定预算时才在level_stats中记录使用的级别与耗时
+        """
+        model = self.model
+        budget = Budget(max_work, max_seconds)
+
+        for level, work, width in ((LEVEL_VITERBI, len(text) * self.level_work[LEVEL_VITERBI], None),
+                                   (LEVEL_BEAM, len(text) * self.beam_work(beam), beam)):
+            if not budget.allows('cut', level, work):
+                continue
+            start = time.perf_counter()
+            try:
+                prob, path = model.decode(text, budget.deadline, width)
+            except DeadlineExceeded as e:
+                level_stats.observe('cut', level, work * e.done, time.perf_counter() - start)
+                continue
+            if budget.limited:
+                level_stats.record('cut', level, work, time.perf_counter() - start)
+            return BudgetResult(make_words(text, [model.states[i] for i in path]), level)
+
+        segment_model = model.segment_model
+        start = time.perf_counter()
+        prob, path = segment_model.decode(text)
+        if budget.limited:
+            level_stats.record('cut', LEVEL_SEGMENT, len(text) * self.level_work[LEVEL_SEGMENT],
+                               time.perf_counter() - start)
+        words = make_words(text, [segment_model.states[i] + '_' for i in path])
+        return BudgetResult([(w, None) for w, t in words], LEVEL_SEGMENT)
+
+    def cut_batch(self, texts, workers=None):
+        """
+        使用线程池对多个句子同时进行标注，所有线程共享同一个只读模型，
+        解码中的矩阵运算会释放GIL，多核机器上吞吐量随线程数增加
 
-                if not line:
-                    # 如果句子为空则跳过这轮循环
-                    continue
+        :param texts: 句子列表
+        :param workers: 线程数，None时由ThreadPoolExecutor决定
+        :return: 每个句子的标注结果，顺序与texts一致
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.cut, texts))
 
-                make_word_list(line)
+    def cut_columnar(self, texts, workers=None, extract=None):
+        """
+        批量标注并直接输出为列式结果，中间只保存状态下标，不生成标签字符串
 
-                words |= set(self.word_dic.keys())
+        :param texts: 句子列表
+        :param workers: 线程数，None时由ThreadPoolExecutor决定
+        :param extract: 对每个句子做抽取的函数，返回字符串列表，如time_extract，结果保存在values列中
+        :return: ColumnarBatch，可以用write()写入文件
+        """
+        model = self.model
 
-                line_state = []
+        def process(text):
+            prob, path = model.decode(text)
+            return path, extract(text) if extract is not None else ()
 
-                for w, t in self.word_dic.items():
-                    # w: 每个词语, t: 每个词语的词性
-                    line_state.extend(make_label(w, t))
+        builder = ColumnarBuilder(model.states)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for text, (path, values) in zip(texts, executor.map(process, texts)):
+                builder.add(text, path, values)
 
-                # for k, v in enumerate(line_state):
-                #     count_dic[v] += 1
-                #     if k == 0:
-                #         # 计算初始概率
-                #         self.Pi_dic[v] += 1
-                #     else:
-                #         # 计算转移概率与发射概率
-                #         self.A_dic[line_state[k - 1]][v] += 1
-                #         # self.B_dic[line_state[k]][]
+        return builder.build()
 
-    def viterbi(self):
-        pass
+    def session(self, lag=8):
+        """
+        创建增量解码会话，用于边输入边标注
 
-    def cut(self):
-        pass
+        :param lag: 最多允许多少个字的标签未确定
+        :return: ViterbiSession
+        """
+        return ViterbiSession(self.model, lag)
+
+    def cut_nbest(self, text, k=5):
+        """
+        返回概率最大的k个不同的分词与词性标注结果，供下游重排序使用
+
+        :param text: 输入的句子
+        :param k: 需要的结果个数
+        :return: 由(对数概率, [(词语, 词性), ...])组成的列表，按概率从大到小排列
+        """
+        results = []
+        if k <= 0:
+            return results
+
+        seen = set()
+        for prob, pos_list in self.model.nbest(text):
+            words = make_words(text, pos_list)
+            key = tuple(words)
+            if key in seen:
+                # 转移已经排除了不合法的序列，只有句首或句尾的词(如以B结尾与以S结尾)可能还原出相同的结果
+                continue
+            seen.add(key)
+            results.append((prob, words))
+            if len(results) >= k:
+                # 取够k个就停止，不再让A*搜索多找一条路径
+                break
+
+        return results
 
 
 if __name__ == '__main__':
     post = PartOfSpeechTagging()
-    post.train("./data/people-daily.txt")
-
-    for k, v in post.word_dic.items():
-        if v not in post.state_list:
-            print(k, v)
+    post.train("./data/people-daily-test.txt")
+
+    with open("./data/people-daily-test.txt", encoding='utf8') as f:
+        sentences = [''.join(w for w, t in make_word_list(line.strip())) for line in f if line.strip()]
+
+    print('live states: %d / %d' % (len(post.model.states), len(post.state_list)))
+    print(post.cut(sentences[0][: 30]))
+    for prob, words in post.cut_nbest(sentences[0][: 30], 3):
+        print('%.2f' % prob, words)
+
+    # 增量解码: 逐字输入，不限制lag时结果与整句解码相同
+    session = post.session(lag=None)
+    for char in sentences[0]:
+        session.feed(char)
+    session.finish()
+    assert session.tags == post.model.viterbi(sentences[0])[1]
+    print(session.words()[: 5])
+
+    # 回放不同长度的请求，统计在计算量预算下各级别解码被使用的次数
+    workload = [s[: n] for s in sentences for n in (10, 50, 200)]
+    print(post.level_work)
+    print(replay('cut', post.cut, workload, max_work=60 * post.level_work[LEVEL_VITERBI]))
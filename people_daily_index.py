@@ -0,0 +1,253 @@
+import codecs
+import os
+import pickle
+import re
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+# 文档编号: 日期-版面-文章-段落
+DOC_ID = re.compile(rb'\d{8}-\d+-\d+-\d+$')
+# 索引文件格式的版本号，与语料的大小、修改时间一起保存，格式改变后旧的索引文件会重新建立
+INDEX_VERSION = 2
+
+
+class CorpusIndex:
+    """
+    人民日报语料的字节偏移索引，保存在语料旁边的索引文件中，不需要每次都扫描整个语料
+    语料中每一行以文档编号开头，如: 19980131-03-017-001/m，分别为日期-版面-文章-段落
+
+    Attribute:
+        corpus_file: 语料路径
+        index_file: 索引文件路径，默认为语料路径加上.idx
+        doc_ids: 每一行的文档编号
+        line_nums: 每一行在语料中的行号(从0开始，包括空行)
+        skipped: 不以文档编号开头的非空行的行号，这些行不进入索引
+        offsets: 每一行开头的字节偏移，最后多记录一个文件末尾的偏移，方便计算每一行的长度
+        dates: 每一行的日期，如19980131
+        id_dic: 文档编号 -> 在索引中的下标
+        date_order: 按日期排序后的下标，用于按日期范围切片
+    """
+
+    def __init__(self, corpus_file, index_file=None):
+        self.corpus_file = corpus_file
+        self.index_file = index_file if index_file is not None else corpus_file + '.idx'
+
+        self.doc_ids = []
+        self.line_nums = array('q')
+        self.skipped = array('q')
+        self.offsets = array('q')
+        self.dates = array('l')
+        self.id_dic = {}
+        self.date_order = array('q')
+        self.sorted_dates = array('l')
+
+    @classmethod
+    def load(cls, corpus_file, index_file=None):
+        """
+        加载索引，索引文件不存在或者语料已经改变时重新建立索引
+
+        :param corpus_file: 语料路径
+        :param index_file: 索引文件路径
+        :return: CorpusIndex
+        """
+        index = cls(corpus_file, index_file)
+        stat = os.stat(corpus_file)
+        if os.path.exists(index.index_file):
+            with open(index.index_file, 'rb') as f:
+                source = pickle.load(f)
+                if source == (INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+                    index.doc_ids = pickle.load(f)
+                    index.line_nums = pickle.load(f)
+                    index.skipped = pickle.load(f)
+                    index.offsets = pickle.load(f)
+                    index.dates = pickle.load(f)
+                    index.make_lookup()
+                    return index
+
+        return index.build()
+
+    def build(self):
+        """
+        扫描一遍语料，记录每一行的文档编号、行号与字节偏移，并保存至index_file
+        文件开头的BOM不计入第一行，不以文档编号开头的行记录在skipped中，不会中断建立索引
+
+        :return: self
+        """
+        self.doc_ids = []
+        self.line_nums = array('q')
+        self.skipped = array('q')
+        self.offsets = array('q')
+        self.dates = array('l')
+
+        stat = os.stat(self.corpus_file)
+        offset = 0
+        with open(self.corpus_file, 'rb') as f:
+            for line_num, line in enumerate(f):
+                start = offset
+                offset += len(line)
+                if line_num == 0 and line.startswith(codecs.BOM_UTF8):
+                    line = line[len(codecs.BOM_UTF8):]
+                    start += len(codecs.BOM_UTF8)
+
+                doc_id = line.split(b'/', 1)[0].strip()
+                if not doc_id:
+                    # 空行没有文档编号，只计入行号
+                    continue
+                if not DOC_ID.match(doc_id):
+                    self.skipped.append(line_num)
+                    continue
+
+                self.doc_ids.append(doc_id.decode('utf8'))
+                self.line_nums.append(line_num)
+                self.offsets.append(start)
+                self.dates.append(int(doc_id[: 8]))
+        self.offsets.append(offset)
+
+        with open(self.index_file, 'wb') as f:
+            pickle.dump((INDEX_VERSION, stat.st_size, stat.st_mtime_ns), f)
+            pickle.dump(self.doc_ids, f)
+            pickle.dump(self.line_nums, f)
+            pickle.dump(self.skipped, f)
+            pickle.dump(self.offsets, f)
+            pickle.dump(self.dates, f)
+
+        self.make_lookup()
+        return self
+
+    def make_lookup(self):
+        """
+        根据索引生成按文档编号查找与按日期切片所需的结构
+
+        :return:
+        """
+        self.id_dic = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        # 语料一般已经按日期排列，sorted是稳定排序，这时只是复制一遍
+        self.date_order = array('q', sorted(range(len(self.dates)), key=self.dates.__getitem__))
+        self.sorted_dates = array('l', (self.dates[i] for i in self.date_order))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def read(self, i):
+        """
+        读取索引中第i行，只需要一次seek
+
+        :param i: 在索引中的下标
+        :return: 该行文本(不包含换行符)
+        """
+        with open(self.corpus_file, 'rb') as f:
+            f.seek(self.offsets[i])
+            # 下一个索引行之前可能还有空行或跳过的行，只读取到本行结束
+            return f.readline().decode('utf8').rstrip('\r\n')
+
+    def get(self, doc_id):
+        """
+        :param doc_id: 文档编号，如19980131-03-017-001
+        :return: 该文档编号所在行的文本
+        """
+        return self.read(self.id_dic[doc_id])
+
+    def find_line(self, line_num):
+        """
+        :param line_num: 在语料中的行号
+        :return: 在索引中的下标，空行返回None
+        """
+        i = bisect_left(self.line_nums, line_num)
+        if i < len(self.line_nums) and self.line_nums[i] == line_num:
+            return i
+        return None
+
+    def date_range(self, start, end):
+        """
+        按日期切片，包含start与end两天
+
+        :param start: 开始日期，如'19980101'或19980101
+        :param end: 结束日期
+        :return: 在索引中的下标列表，按语料中的顺序排列
+        """
+        lo = bisect_left(self.sorted_dates, int(start))
+        hi = bisect_right(self.sorted_dates, int(end))
+        return sorted(self.date_order[lo: hi])
+
+    def split(self, test_ratio=0.1, seed=0):
+        """
+        可复现的训练集/测试集划分，根据文章编号(日期-版面-文章)的哈希值决定属于哪一部分，
+        同一篇文章的段落总是在同一边，语料增加新的文章也不会改变已有文章的划分
+
+        :param test_ratio: 测试集比例
+        :param seed: 随机种子，不同的种子得到不同的划分
+        :return: (训练集下标列表, 测试集下标列表)
+        """
+        train, test = [], []
+        threshold = int(test_ratio * 0xFFFFFFFF)
+        for i, doc_id in enumerate(self.doc_ids):
+            article = doc_id.rsplit('-', 1)[0]
+            if zlib.crc32(('%d:%s' % (seed, article)).encode('utf8')) < threshold:
+                test.append(i)
+            else:
+                train.append(i)
+
+        return train, test
+
+    def shards(self, n):
+        """
+        将语料按字节数均匀地切成n份，切分点都在行首，供多个进程并行读取
+
+        :param n: 份数
+        :return: 由(开始字节, 结束字节)组成的列表
+        """
+        total = self.offsets[-1]
+        bounds = [0]
+        for k in range(1, n):
+            # 找到第一个不早于k / n处的行首
+            i = bisect_left(self.offsets, total * k // n)
+            bounds.append(max(self.offsets[i], bounds[-1]))
+        bounds.append(total)
+
+        return [(bounds[k], bounds[k + 1]) for k in range(n) if bounds[k] < bounds[k + 1]]
+
+    def iter_lines(self, indices):
+        """
+        按下标依次读取多行，共用一个文件句柄
+
+        :param indices: 在索引中的下标
+        :return: 生成器，每次产生一行文本
+        """
+        with open(self.corpus_file, 'rb') as f:
+            for i in indices:
+                f.seek(self.offsets[i])
+                yield f.readline().decode('utf8').rstrip('\r\n')
+
+
+def iter_shard(corpus_file, start, end):
+    """
+    读取shards()切出来的一份语料，从文件开头读取时去掉BOM
+
+    :param corpus_file: 语料路径
+    :param start: 开始字节
+    :param end: 结束字节
+    :return: 生成器，每次产生一行文本
+    """
+    encoding = 'utf-8-sig' if start == 0 else 'utf8'
+    with open(corpus_file, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode(encoding).rstrip('\r\n')
+            encoding = 'utf8'
+
+
+if __name__ == '__main__':
+    index = CorpusIndex.load('./data/people-daily-test.txt')
+    print(len(index), index.doc_ids[: 3])
+    print(index.get(index.doc_ids[1])[: 40])
+    print(len(index.date_range('19980131', '19980131')))
+
+    train, test = index.split(0.3)
+    print(len(train), len(test))
+
+    for start, end in index.shards(3):
+        print(start, end, sum(1 for _ in iter_shard(index.corpus_file, start, end)))
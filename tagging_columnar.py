@@ -0,0 +1,275 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# 文件格式(小端):
+#   文件头: MAGIC, 版本号, 以及下面每一段的长度
+#   状态表: 所有状态标签以'\n'拼接的utf8字符串，每个文件只保存一次
+#   text: 所有句子拼接后的utf-32-le编码，每个字固定4个字节，可以按字的下标直接切片
+#   sentence_offsets: 每个句子在text中的开始位置，最后多记录一个结束位置，int64
+#   sentence_tokens: 每个句子的第一个词在token_offsets中的下标，最后多记录一个结束位置，int64
+#   token_offsets: 每个词在text中的开始位置，最后多记录一个结束位置，int64
+#   state_ids: 每个字的状态在状态表中的下标，uint16
+#   sentence_values: 每个句子的第一个抽取结果在value_offsets中的下标，最后多记录一个结束位置，int64
+#   value_offsets: 每个抽取结果(如time_extract的结果)在values中的字节偏移，最后多记录一个结束位置，int64
+#   values: 所有抽取结果拼接后的utf8编码
+# 每一段都按8字节对齐，读取时用mmap映射文件，各列直接转换为memoryview，不需要重新解析
+MAGIC = b'POSC'
+VERSION = 1
+HEADER = struct.Struct('<4sI8q')
+ALIGN = 8
+
+
+def pad_length(length):
+    """
+    :param length: 一段数据的字节数
+    :return: 对齐到ALIGN字节需要补充的字节数
+    """
+    return -length % ALIGN
+
+
+class ColumnarBatch:
+    """
+    一批句子的列式标注结果，所有列都是连续的整数数组
+
+    Attribute:
+        states: 状态表
+        text: 所有句子拼接后的utf-32-le编码
+        sentence_offsets: 每个句子在text中的开始位置
+        sentence_tokens: 每个句子的第一个词在token_offsets中的下标
+        token_offsets: 每个词在text中的开始位置
+        state_ids: 每个字的状态下标
+        sentence_values: 每个句子的第一个抽取结果在value_offsets中的下标
+        value_offsets: 每个抽取结果在values中的字节偏移
+        values: 所有抽取结果拼接后的utf8编码
+    """
+
+    def __init__(self, states, text, sentence_offsets, sentence_tokens, token_offsets, state_ids,
+                 sentence_values, value_offsets, values, buffer=None):
+        self.states = tuple(states)
+        self.text = text
+        self.sentence_offsets = sentence_offsets
+        self.sentence_tokens = sentence_tokens
+        self.token_offsets = token_offsets
+        self.state_ids = state_ids
+        self.sentence_values = sentence_values
+        self.value_offsets = value_offsets
+        self.values = values
+
+        self._buffer = buffer  # read()时映射的文件，close()时释放
+
+    def __len__(self):
+        return len(self.sentence_offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        释放mmap，之后不能再访问各列
+        调用方从各列切出的memoryview(如batch.token_offsets[0: 2])需要先release()，否则抛出BufferError，
+        这时batch仍然视为已经关闭，映射在这些切片被回收后释放
+
+        :return:
+        """
+        if self._buffer is None:
+            return
+
+        buffer, self._buffer = self._buffer, None
+        try:
+            for column in (self.text, self.sentence_offsets, self.sentence_tokens, self.token_offsets,
+                           self.state_ids, self.sentence_values, self.value_offsets, self.values):
+                if isinstance(column, memoryview):
+                    column.release()
+        finally:
+            buffer.close()
+
+    def get_text(self, begin, end):
+        """
+        :param begin: 开始字的下标
+        :param end: 结束字的下标
+        :return: 拼接后text中[begin, end)之间的字符串
+        """
+        return bytes(self.text[begin * 4: end * 4]).decode('utf-32-le')
+
+    def sentence(self, i):
+        """
+        还原第i个句子的标注结果
+
+        :param i: 句子下标
+        :return: 由(词语, 词性)组成的列表
+        """
+        words = []
+        for k in range(self.sentence_tokens[i], self.sentence_tokens[i + 1]):
+            begin, end = self.token_offsets[k], self.token_offsets[k + 1]
+            words.append((self.get_text(begin, end), self.states[self.state_ids[begin]][2:]))
+
+        return words
+
+    def extracted(self, i):
+        """
+        :param i: 句子下标
+        :return: 第i个句子的抽取结果列表
+        """
+        return [bytes(self.values[self.value_offsets[k]: self.value_offsets[k + 1]]).decode('utf8')
+                for k in range(self.sentence_values[i], self.sentence_values[i + 1])]
+
+    def write(self, path):
+        """
+        写入文件
+
+        :param path: 文件路径
+        :return:
+        """
+        state_table = '\n'.join(self.states).encode('utf8')
+        sections = [state_table, self.text, self.sentence_offsets, self.sentence_tokens, self.token_offsets,
+                    self.state_ids, self.sentence_values, self.value_offsets, self.values]
+        if sys.byteorder != 'little':
+            sections = [s if isinstance(s, bytes) else swapped(s) for s in sections]
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.states), len(self.sentence_offsets) - 1,
+                                len(self.token_offsets) - 1, len(self.state_ids), len(self.value_offsets) - 1,
+                                len(self.values), len(state_table), 0))
+            for section in sections:
+                data = memoryview(section).cast('B')
+                f.write(data)
+                f.write(b'\0' * pad_length(len(data)))
+
+    @classmethod
+    def read(cls, path):
+        """
+        用mmap映射文件，各列直接指向映射的内存，不复制也不解析
+
+        :param path: 文件路径
+        :return: ColumnarBatch，使用完需要close()，也可以用with语句
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError('%s is not a columnar tagging file' % path)
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_states, n_sentences, n_tokens, n_chars, n_values, values_length, state_length, _ = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            buffer.close()
+            raise ValueError('%s is not a columnar tagging file' % path)
+
+        sections = ((state_length, 'B'), (n_chars * 4, 'B'), ((n_sentences + 1) * 8, 'q'),
+                    ((n_sentences + 1) * 8, 'q'), ((n_tokens + 1) * 8, 'q'), (n_chars * 2, 'H'),
+                    ((n_sentences + 1) * 8, 'q'), ((n_values + 1) * 8, 'q'), (values_length, 'B'))
+        size = HEADER.size + sum(length + pad_length(length) for length, fmt in sections)
+        if any(length < 0 for length, fmt in sections) or len(buffer) != size:
+            # 文件被截断或者文件头损坏，各列的长度与文件大小对不上
+            buffer.close()
+            raise ValueError('%s is truncated or corrupted: expected %d bytes' % (path, size))
+
+        view = memoryview(buffer)
+        offset = HEADER.size
+        columns = []
+        for length, fmt in sections:
+            column = view[offset: offset + length].cast(fmt)
+            if sys.byteorder != 'little' and fmt != 'B':
+                # 大端机器上无法直接使用，只能复制一份再转换字节序，复制后释放对mmap的引用
+                copied = swapped(column)
+                column.release()
+                column = copied
+            columns.append(column)
+            offset += length + pad_length(length)
+        view.release()
+
+        states = bytes(columns[0]).decode('utf8').split('\n') if n_states else []
+        columns[0].release()
+
+        return cls(states, *columns[1:], buffer=buffer)
+
+
+def swapped(column):
+    """
+    :param column: 整数数组，array或memoryview
+    :return: 转换字节序后的数组副本
+    """
+    column = array(column.typecode if isinstance(column, array) else column.format, column)
+    column.byteswap()
+    return column
+
+
+class ColumnarBuilder:
+    """
+    逐句添加标注结果，最后生成ColumnarBatch
+
+    Attribute:
+        states: 状态表，state_ids是其中的下标
+    """
+
+    def __init__(self, states):
+        self.states = tuple(states)
+        # 状态是否为词的开头或结尾，用于根据状态下标切分词语
+        self._begins = [s[0] in 'BS' for s in self.states]
+        self._ends = [s[0] in 'ES' for s in self.states]
+
+        self._text = []
+        self._sentence_offsets = array('q', [0])
+        self._sentence_tokens = array('q', [0])
+        self._token_offsets = array('q')
+        self._state_ids = array('H')
+        self._sentence_values = array('q', [0])
+        self._value_offsets = array('q', [0])
+        self._values = bytearray()
+
+    def add(self, text, state_ids, values=()):
+        """
+        添加一个句子的结果
+
+        :param text: 句子
+        :param state_ids: 每个字的状态下标，如HMMModel.decode()的结果
+        :param values: 该句子的抽取结果，如time_extract()的结果
+        :return:
+        """
+        offset = self._sentence_offsets[-1]
+        word_end = True
+        for i, y in enumerate(state_ids):
+            if word_end or self._begins[y]:
+                self._token_offsets.append(offset + i)
+            word_end = self._ends[y]
+
+        self._text.append(text)
+        self._state_ids.extend(state_ids)
+        self._sentence_offsets.append(offset + len(text))
+        self._sentence_tokens.append(len(self._token_offsets))
+
+        for value in values:
+            self._values += value.encode('utf8')
+            self._value_offsets.append(len(self._values))
+        self._sentence_values.append(len(self._value_offsets) - 1)
+
+    def build(self):
+        """
+        :return: ColumnarBatch
+        """
+        token_offsets = array('q', self._token_offsets)
+        token_offsets.append(self._sentence_offsets[-1])
+
+        return ColumnarBatch(self.states, ''.join(self._text).encode('utf-32-le'), self._sentence_offsets,
+                             self._sentence_tokens, token_offsets, self._state_ids, self._sentence_values,
+                             self._value_offsets, bytes(self._values))
+
+
+if __name__ == '__main__':
+    from part_of_speech_tagging import PartOfSpeechTagging, make_word_list
+
+    post = PartOfSpeechTagging()
+    post.train('./data/people-daily-test.txt')
+    with open('./data/people-daily-test.txt', encoding='utf8') as f:
+        sentences = [''.join(w for w, t in make_word_list(line.strip())) for line in f if line.strip()]
+
+    post.cut_columnar(sentences).write('./data/tagging.posc')
+    with ColumnarBatch.read('./data/tagging.posc') as batch:
+        for i, sentence in enumerate(sentences):
+            assert batch.sentence(i) == post.cut(sentence)
+        print(len(batch), len(batch.token_offsets) - 1, batch.sentence(0)[: 5], batch.extracted(0))
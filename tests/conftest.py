@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CORPUS = os.path.join(ROOT, 'data', 'people-daily-test.txt')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', default=False,
+                     help='运行测量耗时的测试，结果依赖机器负载，默认不运行')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: 测量耗时的测试，只在指定--benchmark时运行')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason='测量耗时的测试，需要指定--benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def post(tmp_path_factory):
+    """
+    在样例语料上训练的模型，模型文件写到临时目录，不覆盖data/hmm_model.pkl
+    """
+    from part_of_speech_tagging import PartOfSpeechTagging
+
+    post = PartOfSpeechTagging()
+    post.model_file = str(tmp_path_factory.mktemp('model') / 'hmm_model.pkl')
+    return post.train(CORPUS)
+
+
+@pytest.fixture(scope='session')
+def sentences():
+    """
+    样例语料中去掉词性后的句子
+    """
+    from part_of_speech_tagging import make_word_list
+
+    with open(CORPUS, encoding='utf8') as f:
+        return [''.join(w for w, t in make_word_list(line.strip())) for line in f if line.strip()]
@@ -0,0 +1,66 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('jieba')
+pytest.importorskip('dateutil')
+
+import crf_date_identification as crf  # noqa: E402
+from tagging_columnar import ColumnarBatch  # noqa: E402
+
+TEXTS = ['我要住到明天下午三点', '预定28号的房间', '我要从26号下午4点住到8月2号', '我要预定今天到30号的房间', '今天30号呵呵']
+
+
+def test_time_extract():
+    tomorrow = (datetime.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+    result = crf.time_extract('我要住到明天下午三点')
+    assert result == [tomorrow + ' 15:00:00']
+    assert result.level == 'viterbi'
+
+
+def test_budget_levels():
+    work = crf.warm_up()
+    assert set(work) == set(crf.TIME_EXTRACT_LEVELS)
+    text = TEXTS[0]
+    assert crf.time_extract(text, max_work=0).level == 'segment'
+    assert work['viterbi'] > work['dict']
+    assert crf.time_extract(text, max_work=len(text) * work['dict']).level == 'dict'
+    assert crf.time_extract(text, max_work=len(text) * max(work.values())).level == 'viterbi'
+
+    counts = crf.replay('time_extract', crf.time_extract, TEXTS, max_work=0)
+    assert counts == {'viterbi': 0, 'dict': 0, 'segment': len(TEXTS)}
+
+
+def test_max_work_requires_warm_up(monkeypatch):
+    monkeypatch.setattr(crf, 'time_extract_work', {})
+    with pytest.raises(RuntimeError):
+        crf.time_extract(TEXTS[0], max_work=100)
+    # 只有时间限制时不需要测量
+    assert crf.time_extract(TEXTS[0], max_seconds=10).level == 'viterbi'
+
+
+def test_warm_up_measures_once(monkeypatch):
+    monkeypatch.setattr(crf, 'time_extract_work', {})
+    calls = []
+
+    def measure_work():
+        calls.append(1)
+        return {level: 1.0 for level in crf.TIME_EXTRACT_LEVELS}
+
+    monkeypatch.setattr(crf, 'measure_work', measure_work)
+    threads = [threading.Thread(target=crf.warm_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+
+
+def test_time_extract_columnar(post, tmp_path):
+    path = str(tmp_path / 'time.posc')
+    crf.time_extract_columnar(TEXTS, post, workers=2).write(path)
+    with ColumnarBatch.read(path) as batch:
+        for i, text in enumerate(TEXTS):
+            assert batch.extracted(i) == crf.time_extract(text)
+            assert batch.sentence(i) == post.cut(text)
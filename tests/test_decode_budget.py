@@ -0,0 +1,80 @@
+from decode_budget import LEVELS, LevelStats, level_stats, replay
+
+
+def test_unbudgeted_cut_records_nothing(post, sentences):
+    level_stats.reset('cut')
+    post.cut_batch(sentences, workers=4)
+    assert 'cut' not in level_stats.snapshot()
+
+    post.cut(sentences[0], max_work=10 ** 12)
+    assert level_stats.snapshot()['cut']['viterbi'] == 1
+
+
+def test_replay_resets_only_its_name(post, sentences):
+    level_stats.record('other', 'beam', 1, 0.001)
+    counts = replay('cut', post.cut, sentences, max_work=0)
+    assert counts == {'viterbi': 0, 'beam': 0, 'segment': len(sentences)}
+    assert level_stats.snapshot()['other']['beam'] == 1
+    level_stats.reset('other')
+
+
+def test_reset_keeps_rates():
+    stats = LevelStats()
+    stats.record('a', LEVELS[0], 10, 1.0)
+    stats.record('b', LEVELS[0], 10, 1.0)
+    stats.reset('a')
+    assert stats.snapshot() == {'b': {k: int(k == LEVELS[0]) for k in LEVELS}}
+    assert stats.estimate('a', LEVELS[0], 20) == 2.0
+
+
+def test_registered_levels():
+    stats = LevelStats()
+    stats.register('time_extract', ('viterbi', 'dict', 'segment'))
+    stats.record('time_extract', 'dict', 10, 0.1)
+    stats.record('cut', 'beam', 10, 0.1)
+    assert stats.snapshot() == {'time_extract': {'viterbi': 0, 'dict': 1, 'segment': 0},
+                                'cut': {'viterbi': 0, 'beam': 1, 'segment': 0}}
+
+
+def test_cut_skips_level_that_gave_up(post, sentences, monkeypatch):
+    from part_of_speech_tagging import HMMModel
+
+    monkeypatch.setattr(level_stats, 'rates', {})
+    text = ''.join(sentences) * 3
+    attempts = []
+    decode = HMMModel.decode
+
+    def counting_decode(model, text, deadline=None, beam=None):
+        if model is post.model:
+            attempts.append(beam)
+        return decode(model, text, deadline, beam)
+
+    monkeypatch.setattr(HMMModel, 'decode', counting_decode)
+
+    assert post.cut(text, max_seconds=0.005).level == 'segment'
+    assert attempts == [None, 8]
+    # 放弃的尝试也记录了耗时估计
+    assert ('cut', 'viterbi') in level_stats.rates and ('cut', 'beam') in level_stats.rates
+
+    attempts.clear()
+    assert post.cut(text, max_seconds=0.005).level == 'segment'
+    assert attempts == []
+
+
+def test_level_work_predicts_decode_time(post, sentences):
+    import time
+
+    def best(func):
+        seconds = []
+        for _ in range(5):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    text = ''.join(sentences)
+    model = post.model
+    segment = best(lambda: model.segment_model.decode(text))
+    for level, beam in (('viterbi', None), ('beam', 8)):
+        ratio = best(lambda: model.decode(text, beam=beam)) / segment
+        assert 0.5 < ratio / post.level_work[level] < 2
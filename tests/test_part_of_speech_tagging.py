@@ -0,0 +1,182 @@
+import itertools
+import math
+import os
+import random
+import time
+
+import pytest
+
+from part_of_speech_tagging import make_words
+
+
+def test_cut_starting_with_non_initial_char(post):
+    # '的'在语料中从来没有出现在句首
+    prob, pos_list = post.model.viterbi('的人民')
+    assert math.isfinite(prob)
+    assert ''.join(w for w, t in make_words('的人民', pos_list)) == '的人民'
+
+
+def test_random_windows_have_finite_score(post, sentences):
+    rng = random.Random(0)
+    text = ''.join(sentences)
+    for _ in range(50):
+        start = rng.randrange(len(text) - 20)
+        prob, pos_list = post.model.viterbi(text[start: start + 20])
+        assert math.isfinite(prob)
+
+
+def test_train_with_tag_outside_state_list(tmp_path):
+    from part_of_speech_tagging import PartOfSpeechTagging
+
+    post = PartOfSpeechTagging()
+    post.model_file = str(tmp_path / 'hmm_model.pkl')
+    post.train(['19980101-01-001-001/m 我/Rg 们/k'])
+
+    assert 'S_rg' not in post.state_list
+    assert post.live_states == ['S_k', 'S_rg']
+    assert post.cut('我们') == [('我', 'rg'), ('们', 'k')]
+
+
+def test_live_states_exclude_dead_states(post):
+    assert 'S_m' in post.model.states
+    assert 'B_m' not in post.model.states
+    assert len(post.model.states) < len(post.state_list)
+
+
+def test_model_is_read_only(post):
+    with pytest.raises(AttributeError):
+        post.model.states = ()
+    with pytest.raises(ValueError):
+        post.model.trans_p[0, 0] = 0.0
+
+
+def test_cut_batch_same_results_under_concurrency(post, sentences):
+    texts = sentences * 4
+    expected = [post.cut(t) for t in texts]
+    for workers in (1, 2, 4, 8):
+        assert post.cut_batch(texts, workers) == expected
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason='需要多核才能测量线程数增加带来的吞吐量提升')
+def test_cut_batch_throughput_scales_with_threads(post, sentences):
+    text = ''.join(sentences)
+    texts = [text[i: i + 200] for i in range(0, len(text) - 200, 50)] * 4
+
+    def throughput(workers):
+        start = time.perf_counter()
+        post.cut_batch(texts, workers)
+        return len(texts) / (time.perf_counter() - start)
+
+    single = throughput(1)
+    assert throughput(2) > 1.2 * single
+
+
+def test_cut_nbest_stops_after_k_paths(post, monkeypatch):
+    from part_of_speech_tagging import HMMModel
+
+    pulled = []
+    nbest = HMMModel.nbest
+
+    def counting_nbest(model, text):
+        for item in nbest(model, text):
+            pulled.append(item)
+            yield item
+
+    monkeypatch.setattr(HMMModel, 'nbest', counting_nbest)
+    results = post.cut_nbest('人民', 2)
+    assert len(results) == 2
+    assert [p for p, w in results] == sorted((p for p, w in results), reverse=True)
+    assert results[0][1] == post.cut('人民')
+    # 前两条路径还原出的结果不同，只需要从生成器中取两次
+    assert len(pulled) == 2
+
+    pulled.clear()
+    assert post.cut_nbest('人民', 0) == []
+    assert pulled == []
+
+
+def test_nbest_matches_exhaustive_search():
+    import itertools
+
+    from part_of_speech_tagging import HMMModel, NEG_INF
+
+    states = ['B_a', 'M_a', 'E_a', 'S_a', 'S_b']
+    start_p = {'B_a': 0.5, 'S_a': 0.3, 'S_b': 0.2}
+    trans_p = {y0: {y: (i + j + 1) / 15 for j, y in enumerate(states)} for i, y0 in enumerate(states)}
+    emit_p = {'B_a': {'甲': 0.6, '乙': 0.4}, 'M_a': {'乙': 1.0}, 'E_a': {'乙': 0.7, '丙': 0.3},
+              'S_a': {'甲': 0.5, '丙': 0.5}, 'S_b': {'乙': 0.2, '丙': 0.8}}
+    model = HMMModel(states, start_p, trans_p, emit_p)
+    text = '甲乙丙乙'
+
+    def score(path):
+        ids = [states.index(y) for y in path]
+        emit = model.emissions(text)
+        prob = model.start_p[ids[0]] + emit[0, ids[0]]
+        for t in range(1, len(text)):
+            prob += model.trans_p[ids[t - 1], ids[t]] + emit[t, ids[t]]
+        return prob
+
+    expected = sorted((score(p) for p in itertools.product(states, repeat=len(text))), reverse=True)
+    expected = [p for p in expected if p > NEG_INF]
+    results = list(model.nbest(text))
+    assert len(results) == len(expected)
+    assert [p for p, path in results] == pytest.approx(expected)
+    assert all(score(path) == pytest.approx(p) for p, path in results)
+    assert len({tuple(path) for p, path in results}) == len(results)
+
+
+def test_nbest_paths_follow_position_constraints(post, sentences):
+    for prob, path in itertools.islice(post.model.nbest(sentences[0][: 40]), 20):
+        for y0, y in zip(path, path[1:]):
+            if y0[0] in 'BM':
+                assert y[0] in 'ME' and y[2:] == y0[2:]
+            else:
+                assert y[0] in 'BS'
+
+
+def test_session_without_lag_matches_viterbi(post, sentences):
+    for sentence in sentences:
+        session = post.session(lag=None)
+        committed = []
+        for char in sentence:
+            committed.extend(session.feed(char))
+        committed.extend(session.finish())
+        assert session.tags == committed == post.model.viterbi(sentence)[1]
+        assert session.words() == post.cut(sentence)
+
+
+@pytest.mark.parametrize('lag', [0, 1, 3, 8])
+def test_session_keeps_at_most_lag_pending(post, sentences, lag):
+    session = post.session(lag=lag)
+    for char in sentences[0]:
+        session.feed(char)
+        assert len(session.chars) - len(session.tags) <= lag
+    session.finish()
+    assert len(session.tags) == len(sentences[0])
+
+
+def test_session_feed_many_chars_at_once(post, sentences):
+    text = sentences[1][: 30]
+    for lag in (None, 2):
+        one, many = post.session(lag), post.session(lag)
+        for i in range(0, len(text), 3):
+            one_tags = []
+            for char in text[i: i + 3]:
+                one_tags.extend(one.feed(char))
+            assert many.feed(text[i: i + 3]) == one_tags
+        assert one.finish() == many.finish()
+        assert one.tags == many.tags
+
+
+def test_session_empty_feed_and_finish(post):
+    session = post.session()
+    assert session.feed('') == []
+    assert session.finish() == []
+    assert session.words() == []
+
+    session.feed('人民')
+    assert session.feed('') == []
+    session.finish()
+    assert session.finish() == []
+    assert ''.join(w for w, t in session.words()) == '人民'
@@ -0,0 +1,94 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import CORPUS
+from people_daily_index import CorpusIndex, iter_shard
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = str(tmp_path / 'people-daily.txt')
+    shutil.copy(CORPUS, path)
+    return path
+
+
+@pytest.fixture
+def lines():
+    with open(CORPUS, encoding='utf8') as f:
+        return [line.rstrip('\r\n') for line in f]
+
+
+def test_get(corpus, lines):
+    index = CorpusIndex.load(corpus)
+    assert len(index) == len(lines)
+    for line in lines:
+        assert index.get(line.split('/', 1)[0]) == line
+    assert list(index.iter_lines(range(len(index)))) == lines
+
+
+def test_date_range_on_unsorted_dates(corpus, lines):
+    index = CorpusIndex.load(corpus)
+    # 样例语料中19980119排在19980131之后
+    assert index.dates.tolist() == [19980131] * 5 + [19980119]
+    assert index.date_range('19980119', '19980119') == [5]
+    assert index.date_range(19980120, 19980131) == [0, 1, 2, 3, 4]
+    assert index.date_range('19980101', '19980228') == list(range(6))
+    assert index.date_range('19980201', '19980228') == []
+
+
+def test_split_is_reproducible_and_keeps_articles_together(corpus):
+    index = CorpusIndex.load(corpus)
+    article = [i for i, doc_id in enumerate(index.doc_ids) if doc_id.startswith('19980131-01-003-')]
+    assert len(article) == 2
+
+    for seed in range(20):
+        train, test = index.split(0.5, seed)
+        assert sorted(train + test) == list(range(len(index)))
+        assert (train, test) == index.split(0.5, seed)
+        assert set(article) <= set(train) or set(article) <= set(test)
+
+
+def test_shards_read_every_line_once(corpus, lines):
+    index = CorpusIndex.load(corpus)
+    for n in (1, 2, 3, 6, 10):
+        shards = index.shards(n)
+        assert shards[0][0] == 0 and shards[-1][1] == os.path.getsize(corpus)
+        assert [line for start, end in shards for line in iter_shard(corpus, start, end)] == lines
+
+
+def test_rebuild_after_corpus_changes(corpus, monkeypatch):
+    index = CorpusIndex.load(corpus)
+    assert os.path.exists(index.index_file)
+
+    def fail(self):
+        raise AssertionError('index should not be rebuilt')
+
+    with monkeypatch.context() as m:
+        m.setattr(CorpusIndex, 'build', fail)
+        assert CorpusIndex.load(corpus).doc_ids == index.doc_ids
+
+    with open(corpus, 'a', encoding='utf8') as f:
+        # 样例语料最后一行没有换行符
+        f.write('\n19980201-01-001-001/m 新/a 的/u 一天/m\n')
+    index = CorpusIndex.load(corpus)
+    assert index.doc_ids[-1] == '19980201-01-001-001'
+    assert index.get('19980201-01-001-001').endswith('一天/m')
+
+
+def test_bom_and_bad_lines(tmp_path):
+    path = str(tmp_path / 'people-daily.txt')
+    with open(path, 'wb') as f:
+        f.write(b'\xef\xbb\xbf19980101-01-001-001/m \xe4\xbd\xa0/r\n'
+                b'\n'
+                b'not a document id/x\n'
+                b'19980102-01-001-001/m \xe5\xa5\xbd/a\n')
+
+    index = CorpusIndex.load(path)
+    assert index.doc_ids == ['19980101-01-001-001', '19980102-01-001-001']
+    assert index.skipped.tolist() == [2]
+    assert index.get('19980101-01-001-001') == '19980101-01-001-001/m 你/r'
+    assert index.find_line(3) == 1 and index.find_line(2) is None
+    assert next(iter_shard(path, 0, 1)) == '19980101-01-001-001/m 你/r'
+    assert CorpusIndex.load(path).skipped.tolist() == [2]
@@ -0,0 +1,76 @@
+import sys
+
+import pytest
+
+from tagging_columnar import ColumnarBatch, ColumnarBuilder
+
+
+def extract_time_words(text):
+    return [c for c in text if c in '年月日']
+
+
+def test_cut_columnar_round_trip(post, sentences, tmp_path):
+    path = str(tmp_path / 'batch.posc')
+    post.cut_columnar(sentences, extract=extract_time_words).write(path)
+
+    with ColumnarBatch.read(path) as batch:
+        assert len(batch) == len(sentences)
+        assert batch.states == post.model.states
+        for i, sentence in enumerate(sentences):
+            assert batch.sentence(i) == post.cut(sentence)
+            assert batch.extracted(i) == extract_time_words(sentence)
+
+
+def test_read_big_endian_releases_buffer(tmp_path, monkeypatch):
+    builder = ColumnarBuilder(['B_t', 'E_t', 'S_p'])
+    builder.add('在明天', [2, 0, 1], ['明天'])
+    path = str(tmp_path / 'batch.posc')
+
+    # 模拟大端机器: 写入时转换为小端，读取时复制一份再转换回来
+    monkeypatch.setattr(sys, 'byteorder', 'big')
+    builder.build().write(path)
+    batch = ColumnarBatch.read(path)
+    assert batch.sentence(0) == [('在', 'p'), ('明天', 't')]
+    assert batch.extracted(0) == ['明天']
+    batch.close()
+
+
+def test_read_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        ColumnarBatch.read(str(path))
+
+
+def write_sample(path):
+    builder = ColumnarBuilder(['B_t', 'E_t', 'S_p'])
+    builder.add('在明天', [2, 0, 1], ['明天'])
+    builder.add('在', [2])
+    builder.build().write(path)
+
+
+def test_close_with_outstanding_slice(tmp_path):
+    path = str(tmp_path / 'batch.posc')
+    write_sample(path)
+
+    batch = ColumnarBatch.read(path)
+    offsets = batch.token_offsets[0: 2]
+    with pytest.raises(BufferError):
+        batch.close()
+    # 已经视为关闭，再次close()不会重复报错
+    batch.close()
+    with pytest.raises(ValueError):
+        batch.sentence(0)
+    assert offsets.tolist() == [0, 1]
+    offsets.release()
+
+
+# size为截断后的字节数，-1表示在文件末尾多写8个字节
+@pytest.mark.parametrize('size', [0, 10, 60, -1])
+def test_read_rejects_truncated_files(tmp_path, size):
+    path = tmp_path / 'batch.posc'
+    write_sample(str(path))
+    data = path.read_bytes()
+    path.write_bytes(data[: size] if size >= 0 else data + b'\0' * 8)
+    with pytest.raises(ValueError):
+        ColumnarBatch.read(str(path))